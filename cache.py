@@ -0,0 +1,10 @@
+import os
+from redis import asyncio as redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+pool = redis.ConnectionPool.from_url(
+    REDIS_URL, max_connections=50, decode_responses=True
+)
+
+redis_client = redis.Redis(connection_pool=pool)
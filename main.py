@@ -1,116 +1,334 @@
-from fastapi import FastAPI, Depends, Request, Form, UploadFile, File, HTTPException, status, Cookie
+from fastapi import FastAPI, Depends, Request, Form, UploadFile, File, HTTPException, status, Cookie, BackgroundTasks, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, exists, literal, and_, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, load_only
 from database import SessionLocal, engine
+from cache import redis_client
 import models
 from passlib.context import CryptContext
+from itsdangerous import TimestampSigner, BadSignature
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 from fastapi.staticfiles import StaticFiles
-import shutil
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
-import uuid
+import secrets
+from pathlib import Path
+import json
 import os
+import io
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", "2"))
+
+def migrate_schema(conn):
+    # create_all only creates missing tables, so columns and indexes added to
+    # existing tables have to be brought up to date here. The ratings indexes
+    # go first so the rating_count backfill can use (product_id, user_id).
+    unique_constraints = [uc["column_names"] for uc in inspect(conn).get_unique_constraints("ratings")]
+    if ["user_id", "product_id"] in unique_constraints:
+        if conn.dialect.name == "sqlite":
+            # SQLite cannot alter a table constraint, so rebuild the table.
+            conn.execute(text("ALTER TABLE ratings RENAME TO ratings_old"))
+            for index in ("ix_ratings_id", "ix_ratings_product_id", "ix_rating_user"):
+                conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+            models.Rating.__table__.create(conn)
+            conn.execute(text(
+                "INSERT INTO ratings (id, user_id, product_id) "
+                "SELECT id, user_id, product_id FROM ratings_old"
+            ))
+            conn.execute(text("DROP TABLE ratings_old"))
+        else:
+            conn.execute(text("ALTER TABLE ratings DROP CONSTRAINT _user_product_uc"))
+            conn.execute(text("ALTER TABLE ratings ADD CONSTRAINT _user_product_uc UNIQUE (product_id, user_id)"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_ratings_product_id"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_rating_user ON ratings (user_id)"))
+    
+    columns = {column["name"] for column in inspect(conn).get_columns("products")}
+    if "rating_count" not in columns:
+        conn.execute(text("ALTER TABLE products ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text(
+            "UPDATE products SET rating_count = "
+            "(SELECT COUNT(*) FROM ratings WHERE ratings.product_id = products.id)"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_products_rating_count ON products (rating_count)"))
+
+MIGRATION_LOCK_ID = 20240601
+MIGRATION_LOCK_TIMEOUT = 600
+
+async def migrate_database():
+    # Every worker runs this at startup. Take a database-wide lock first so
+    # only one of them creates or alters tables; the others wait, then find
+    # the schema already up to date.
+    async with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # Rebuilding a large ratings table can take well over the default
+            # 5 s busy timeout; let the waiting workers outlast it.
+            await conn.exec_driver_sql(f"PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT * 1000}")
+            await conn.exec_driver_sql("BEGIN EXCLUSIVE")
+        elif conn.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.run_sync(migrate_schema)
+        await conn.commit()
+        if conn.dialect.name == "sqlite":
+            await conn.exec_driver_sql("PRAGMA busy_timeout = 5000")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await migrate_database()
+    # Each uvicorn worker gets its own pool, so keep it small by default:
+    # with --workers N there are N * HASH_POOL_SIZE hashing processes.
+    app.state.hash_pool = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE)
+    yield
+    app.state.hash_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+STATIC_BASE = os.getenv("STATIC_BASE", "/static")
 
 templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+templates.env.globals["STATIC_BASE"] = STATIC_BASE
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+templates.env.auto_reload = os.getenv("TEMPLATES_AUTO_RELOAD") == "1"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+if STATIC_BASE == "/static":
+    app.mount("/static", StaticFiles(directory="static"), name="static")
 
-def get_db():
-    db = SessionLocal()
-    try:
+IMAGE_DIR = Path("static", "images")
+IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default="argon2",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+    deprecated="auto",
+)
+
+def hash_password(password: str):
+    return pwd_context.hash(password)
+
+def verify_password(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+async def run_in_hash_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(app.state.hash_pool, func, *args)
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-sessions = {}
+COPY_BUFSIZE = 256 * 1024
+
+def _fastcopy_upload(src, dst):
+    buf = bytearray(COPY_BUFSIZE)
+    view = memoryview(buf)
+    while True:
+        n = src.readinto(buf)
+        if not n:
+            break
+        dst.write(view[:n])
+
+def _disk_fileno(f):
+    # SpooledTemporaryFile.fileno() would force an in-memory upload to disk,
+    # so ask the file it wraps (the private _file attribute) instead. If that
+    # attribute ever goes away we fall back to the wrapper, which still works
+    # but rolls small uploads to disk first.
+    f = getattr(f, "_file", f)
+    try:
+        return f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+def save_upload(upload: UploadFile, path: Path):
+    src = upload.file
+    src.seek(0)
+    src_fd = _disk_fileno(src)
+    with open(path, "wb") as buffer:
+        # When the upload is already on disk both ends are real files, so the
+        # kernel can copy them without going through Python.
+        if src_fd is not None and hasattr(os, "sendfile"):
+            size = os.fstat(src_fd).st_size
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(buffer.fileno(), src_fd, offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+        else:
+            _fastcopy_upload(src, buffer)
+
+def remove_image(path: Path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    if os.getenv("ALLOW_EPHEMERAL_SECRET_KEY") != "1":
+        raise RuntimeError("SECRET_KEY must be set; session cookies are signed with it")
+    logger.warning(
+        "SECRET_KEY is not set; using a random per-process key. Sessions will not "
+        "survive restarts or be shared between workers. Do not use this in production."
+    )
+    SECRET_KEY = secrets.token_urlsafe(32)
+signer = TimestampSigner(SECRET_KEY)
+
+SESSION_TTL = 86400
+USER_CACHE_TTL = 300
+HOME_CACHE_KEY = "home:v3"
+HOME_CACHE_VERSION_KEY = "home:version"
+HOME_CACHE_TTL = 60
+PAGE_SIZE = 24
+MAX_PAGE = 1000
+
+async def cache_user(user: models.User):
+    payload = json.dumps({"id": user.id, "username": user.username, "email": user.email, "whatsapp": user.whatsapp})
+    await redis_client.setex(f"user:{user.id}", USER_CACHE_TTL, payload)
+
+def create_session_token(user: models.User):
+    # The nonce keeps tokens unique, so revoking one on logout cannot revoke
+    # a new login for the same user signed within the same second.
+    return signer.sign(f"{user.id}:{secrets.token_hex(8)}").decode()
 
-def get_current_user(session_token: Optional[str] = Cookie(None), db: Session = Depends(get_db)):
-    if session_token and session_token in sessions:
-        user_id = sessions[session_token]
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-        return user
-    return None
+def read_session_token(session_token: str):
+    try:
+        value = signer.unsign(session_token, max_age=SESSION_TTL)
+    except BadSignature:
+        return None
+    return int(value.split(b":")[0])
+
+async def get_current_user(session_token: Optional[str] = Cookie(None), db: AsyncSession = Depends(get_db)):
+    if not session_token:
+        return None
+    user_id = read_session_token(session_token)
+    if user_id is None:
+        return None
+    revoked, cached = await redis_client.mget(f"revoked:{session_token}", f"user:{user_id}")
+    if revoked is not None:
+        return None
+    if cached is not None:
+        return models.User(**json.loads(cached))
+    result = await db.execute(select(models.User).filter(models.User.id == user_id))
+    user = result.scalars().first()
+    if user:
+        await cache_user(user)
+    return user
 
 @app.get("/register", response_class=HTMLResponse)
-def register(request: Request):
+async def register(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 
 @app.post("/register")
-def register_user(request: Request, 
-                  username: str = Form(...),
-                  email: str = Form(...), 
-                  password: str = Form(...), 
-                  whatsapp: str = Form(...),  
-                  db: Session = Depends(get_db)):
-                  
-    existing_user = db.query(models.User).filter(
-        (models.User.username == username) | (models.User.email == email)
-    ).first()
-    if existing_user:
-        return templates.TemplateResponse("register.html", {"request": request, "msg": "El usuario o el correo ya existen"})
-    
-    hashed_password = pwd_context.hash(password)
+async def register_user(request: Request, 
+                        username: str = Form(...),
+                        email: str = Form(...), 
+                        password: str = Form(...), 
+                        whatsapp: str = Form(...),  
+                        db: AsyncSession = Depends(get_db)):
+                        
+    hashed_password = await run_in_hash_pool(hash_password, password)
     user = models.User(username=username, email=email, hashed_password=hashed_password, whatsapp=whatsapp)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return templates.TemplateResponse("register.html", {"request": request, "msg": "El usuario o el correo ya existen"})
+    await db.refresh(user)
     
-    session_token = str(uuid.uuid4())
-    sessions[session_token] = user.id
+    session_token = create_session_token(user)
+    await cache_user(user)
     response = RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     response.set_cookie(key="session_token", value=session_token)
     return response
 
 @app.get("/login", response_class=HTMLResponse)
-def login(request: Request):
+async def login(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/login")
-def login_user(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user or not pwd_context.verify(password, user.hashed_password):
+async def login_user(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(models.User).filter(models.User.username == username))
+    user = result.scalars().first()
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await run_in_hash_pool(verify_password, password, user.hashed_password)
+    if not verified:
         return templates.TemplateResponse("login.html", {"request": request, "msg": "Credenciales incorrectas"})
     
-    session_token = str(uuid.uuid4())
-    sessions[session_token] = user.id
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    
+    session_token = create_session_token(user)
+    await cache_user(user)
     response = RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     response.set_cookie(key="session_token", value=session_token)
     return response
 
 @app.get("/logout")
-def logout(request: Request):
+async def logout(request: Request):
     session_token = request.cookies.get("session_token")
-    if session_token and session_token in sessions:
-        del sessions[session_token]
+    if session_token and read_session_token(session_token) is not None:
+        await redis_client.setex(f"revoked:{session_token}", SESSION_TTL, 1)
     response = RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     response.delete_cookie(key="session_token")
     return response
 
 @app.get("/", response_class=HTMLResponse)
-def read_products(request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    products = db.query(models.Product).all()
-    products_with_ratings = []
-    
-    for product in products:
-        rating_count = len(product.ratings)
-        products_with_ratings.append((product, rating_count))
-    
-    products_with_ratings.sort(key=lambda x: x[1], reverse=True)
+async def read_products(request: Request, page: int = Query(0, ge=0, le=MAX_PAGE), db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    # Writes bump the version instead of deleting keys, so a read that raced
+    # a write can only repopulate a version nobody asks for anymore.
+    version = await redis_client.get(HOME_CACHE_VERSION_KEY) or 0
+    cache_key = f"{HOME_CACHE_KEY}:{version}:{page}"
+    cached = await redis_client.get(cache_key)
+    if cached is not None:
+        products_with_ratings, has_next = json.loads(cached)
+    else:
+        result = await db.execute(
+            select(models.Product)
+            .options(
+                load_only(models.Product.id, models.Product.name, models.Product.price, models.Product.stock,
+                          models.Product.image, models.Product.owner_id, models.Product.rating_count),
+                selectinload(models.Product.owner).load_only(models.User.id, models.User.username),
+            )
+            .order_by(models.Product.rating_count.desc(), models.Product.id.desc())
+            .limit(PAGE_SIZE + 1)
+            .offset(page * PAGE_SIZE)
+        )
+        products_with_ratings = [
+            ({"id": p.id, "name": p.name, "price": p.price, "stock": p.stock, "image": p.image,
+              "owner": {"id": p.owner.id, "username": p.owner.username}}, p.rating_count)
+            for p in result.scalars().all()
+        ]
+        has_next = len(products_with_ratings) > PAGE_SIZE
+        products_with_ratings = products_with_ratings[:PAGE_SIZE]
+        if page > 0 and not products_with_ratings:
+            raise HTTPException(status_code=404, detail="Página no encontrada")
+        await redis_client.setex(cache_key, HOME_CACHE_TTL, json.dumps([products_with_ratings, has_next]))
     
     return templates.TemplateResponse("index.html", {
         "request": request, 
         "products_with_ratings": products_with_ratings, 
+        "page": page, 
+        "has_next": has_next, 
         "current_user": current_user
     })
 
 
 @app.get("/add_product", response_class=HTMLResponse)
-def add_product_form(request: Request, current_user: models.User = Depends(get_current_user)):
+async def add_product_form(request: Request, current_user: models.User = Depends(get_current_user)):
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
@@ -122,16 +340,12 @@ def add_product_form(request: Request, current_user: models.User = Depends(get_c
 @app.post("/add_product")
 async def add_product(request: Request, name: str = Form(...), description: str = Form(...), 
                       price: float = Form(...), stock: int = Form(...), 
-                      image: UploadFile = File(...), db: Session = Depends(get_db), 
+                      image: UploadFile = File(...), db: AsyncSession = Depends(get_db), 
                       current_user: models.User = Depends(get_current_user)):
     
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    image_dir = os.path.join("static", "images")
-    if not os.path.exists(image_dir):
-        os.makedirs(image_dir)
-
     if not image.filename:
         return templates.TemplateResponse("add_product.html", {
             "request": request, 
@@ -139,60 +353,63 @@ async def add_product(request: Request, name: str = Form(...), description: str
             "msg": "No se ha cargado ninguna imagen"
         })
     
-    image_filename = f"{uuid.uuid4()}_{image.filename}"
-    image_path = os.path.join("static", "images", image_filename)
+    image_filename = f"{secrets.token_hex(8)}_{image.filename}"
+    image_path = IMAGE_DIR / image_filename
     
-    with open(image_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+    await run_in_threadpool(save_upload, image, image_path)
     
     product = models.Product(name=name, description=description, price=price, 
                              stock=stock, image=image_filename, 
                              owner_id=current_user.id)
     
     db.add(product)
-    db.commit()
-    db.refresh(product)
+    await db.commit()
+    await redis_client.incr(HOME_CACHE_VERSION_KEY)
+    await db.refresh(product)
     
     return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
 
 
 @app.get("/product/{product_id}", response_class=HTMLResponse)
-def product_detail(request: Request, product_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    
-    if not product:
+async def product_detail(request: Request, product_id: int, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    user_has_rated = literal(False)
+    if current_user:
+        user_has_rated = exists().where(and_(
+            models.Rating.product_id == product_id,
+            models.Rating.user_id == current_user.id
+        )).correlate(None)
+    
+    result = await db.execute(
+        select(models.Product, user_has_rated.label("user_has_rated"))
+        .options(selectinload(models.Product.owner))
+        .filter(models.Product.id == product_id)
+    )
+    row = result.first()
+    
+    if not row:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    rating_count = len(product.ratings)
-    
-    user_has_rated = False
-    if current_user:
-        existing_rating = db.query(models.Rating).filter(
-            models.Rating.user_id == current_user.id, 
-            models.Rating.product_id == product_id
-        ).first()
-        
-        if existing_rating:
-            user_has_rated = True
+    product, user_has_rated = row
     
     return templates.TemplateResponse("product_detail.html", {
         "request": request, 
         "product": product, 
-        "rating_count": rating_count, 
+        "rating_count": product.rating_count, 
         "user_has_rated": user_has_rated, 
         "current_user": current_user
     })
 
 
 @app.get("/edit_product/{product_id}", response_class=HTMLResponse)
-def edit_product_form(request: Request, product_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def edit_product_form(request: Request, product_id: int, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    product = db.query(models.Product).filter(
+    result = await db.execute(select(models.Product).filter(
         models.Product.id == product_id, 
         models.Product.owner_id == current_user.id
-    ).first()
+    ))
+    product = result.scalars().first()
     
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado o no tienes permiso para editarlo")
@@ -204,18 +421,20 @@ def edit_product_form(request: Request, product_id: int, db: Session = Depends(g
     })
 
 @app.post("/edit_product/{product_id}")
-async def edit_product(product_id: int, request: Request, name: str = Form(...), description: str = Form(...), 
+async def edit_product(product_id: int, request: Request, background_tasks: BackgroundTasks, 
+                       name: str = Form(...), description: str = Form(...), 
                        price: float = Form(...), stock: int = Form(...), 
-                       image: UploadFile = File(None), db: Session = Depends(get_db), 
+                       image: UploadFile = File(None), db: AsyncSession = Depends(get_db), 
                        current_user: models.User = Depends(get_current_user)):
     
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    product = db.query(models.Product).filter(
+    result = await db.execute(select(models.Product).filter(
         models.Product.id == product_id, 
         models.Product.owner_id == current_user.id
-    ).first()
+    ))
+    product = result.scalars().first()
     
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado o no tienes permiso para editarlo")
@@ -226,50 +445,49 @@ async def edit_product(product_id: int, request: Request, name: str = Form(...),
     product.stock = stock
     
     if image and image.filename:
-        old_image_path = os.path.join("static", "images", product.image)
-        if os.path.exists(old_image_path):
-            os.remove(old_image_path)
+        background_tasks.add_task(remove_image, IMAGE_DIR / product.image)
         
-        image_filename = f"{uuid.uuid4()}_{image.filename}"
-        image_path = os.path.join("static", "images", image_filename)
+        image_filename = f"{secrets.token_hex(8)}_{image.filename}"
+        image_path = IMAGE_DIR / image_filename
         
-        with open(image_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+        await run_in_threadpool(save_upload, image, image_path)
         
         product.image = image_filename
     
-    db.commit()
-    db.refresh(product)
+    await db.commit()
+    await redis_client.incr(HOME_CACHE_VERSION_KEY)
+    await db.refresh(product)
     
     return RedirectResponse(url=f"/product/{product_id}", status_code=status.HTTP_302_FOUND)
 
 
 @app.post("/delete_product/{product_id}")
-def delete_product(product_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def delete_product(product_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
     
-    product = db.query(models.Product).filter(
+    result = await db.execute(select(models.Product).options(selectinload(models.Product.ratings)).filter(
         models.Product.id == product_id, 
         models.Product.owner_id == current_user.id
-    ).first()
+    ))
+    product = result.scalars().first()
     
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado o no tienes permiso para eliminarlo")
     
-    image_path = os.path.join("static", "images", product.image)
-    if os.path.exists(image_path):
-        os.remove(image_path)
+    background_tasks.add_task(remove_image, IMAGE_DIR / product.image)
     
-    db.delete(product)
-    db.commit()
+    await db.delete(product)
+    await db.commit()
+    await redis_client.incr(HOME_CACHE_VERSION_KEY)
     
     return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
 
 
 @app.get("/user/{user_id}", response_class=HTMLResponse)
-def user_detail(request: Request, user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def user_detail(request: Request, user_id: int, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    result = await db.execute(select(models.User).filter(models.User.id == user_id))
+    user = result.scalars().first()
     
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
@@ -282,27 +500,28 @@ def user_detail(request: Request, user_id: int, db: Session = Depends(get_db), c
 
 
 @app.post("/rate_product/{product_id}")
-def rate_product(product_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def rate_product(product_id: int, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if not current_user:
         raise HTTPException(status_code=401, detail="Debes iniciar sesión para puntuar un producto")
     
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    result = await db.execute(
+        update(models.Product)
+        .where(models.Product.id == product_id)
+        .values(rating_count=models.Product.rating_count + 1)
+    )
     
-    if not product:
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    existing_rating = db.query(models.Rating).filter(
-        models.Rating.user_id == current_user.id, 
-        models.Rating.product_id == product_id
-    ).first()
-    
-    if existing_rating:
-        raise HTTPException(status_code=400, detail="Ya has puntuado este producto")
-    
     rating = models.Rating(user_id=current_user.id, product_id=product_id)
     db.add(rating)
-    db.commit()
-    db.refresh(rating)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Ya has puntuado este producto")
+    await redis_client.incr(HOME_CACHE_VERSION_KEY)
+    await db.refresh(rating)
     
     return RedirectResponse(url=f"/product/{product_id}", status_code=status.HTTP_302_FOUND)
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -24,6 +24,7 @@ class Product(Base):
     stock = Column(Integer, nullable=False)
     image = Column(String, nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    rating_count = Column(Integer, nullable=False, server_default="0", index=True)
 
     owner = relationship("User", back_populates="products")
     ratings = relationship("Rating", back_populates="product")
@@ -39,4 +40,7 @@ class Rating(Base):
     user = relationship("User", back_populates="ratings")
     product = relationship("Product", back_populates="ratings")
     
-    __table_args__ = (UniqueConstraint('user_id', 'product_id', name='_user_product_uc'),)
\ No newline at end of file
+    __table_args__ = (
+        UniqueConstraint('product_id', 'user_id', name='_user_product_uc'),
+        Index('ix_rating_user', 'user_id'),
+    )
\ No newline at end of file